@@ -0,0 +1,487 @@
+"""
+Device-side helpers shared by the ZKTeco middleware: environment setup,
+timestamp parsing, device sessions and attendance retrieval.
+"""
+from zk import ZK
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from functools import lru_cache
+from bisect import bisect_left
+from itertools import islice
+from operator import attrgetter, le
+import os, re, time, locale, threading, queue, atexit
+
+# =====================================================
+# ENVIRONMENT INITIALIZATION (Docker / K8s SAFE)
+# =====================================================
+def initialize_environment():
+    """Force consistent locale and timezone handling (PHT)."""
+    try:
+        locale.setlocale(locale.LC_ALL, "C")
+    except:
+        pass
+    # Set once per process and only on change; the image already exports TZ
+    if os.environ.get("TZ") != "Asia/Manila":
+        os.environ["TZ"] = "Asia/Manila"  # UTC+8
+        if hasattr(time, "tzset"):
+            time.tzset()
+
+initialize_environment()
+
+# =====================================================
+# TIMESTAMP FORMATS
+# =====================================================
+TIMESTAMP_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+    "%m-%d-%Y %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%Y%m%d%H%M%S",
+    "%d.%m.%Y %H:%M:%S",
+    "%Y.%m.%d %H:%M:%S",
+]
+
+# Same digit patterns strptime uses, so matches stay identical
+FORMAT_DIRECTIVES = {
+    "%Y": r"(?P<{p}Y>\d\d\d\d)",
+    "%m": r"(?P<{p}m>1[0-2]|0[1-9]|[1-9])",
+    "%d": r"(?P<{p}d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])",
+    "%H": r"(?P<{p}H>2[0-3]|[0-1]\d|\d)",
+    "%M": r"(?P<{p}M>[0-5]\d|\d)",
+    "%S": r"(?P<{p}S>6[0-1]|[0-5]\d|\d)",
+}
+DATETIME_FIELDS = ("Y", "m", "d", "H", "M", "S")
+
+def _fmt_to_regex(fmt, prefix=""):
+    pattern = re.escape(fmt).replace(r"\ ", r"\s+")
+    for directive, group in FORMAT_DIRECTIVES.items():
+        pattern = pattern.replace(re.escape(directive), group.format(p=prefix))
+    return pattern
+
+# Compiled once at import; parsing never re-reads the format strings
+COMPILED_FORMATS = [(fmt, re.compile(_fmt_to_regex(fmt), re.IGNORECASE)) for fmt in TIMESTAMP_FORMATS]
+
+# All formats as one alternation, tried in list order by a single regex scan.
+# Alternative i is wrapped in group "F<i>" with its fields named "F<i>_Y", ...
+TIMESTAMP_RE = re.compile(
+    "|".join(f"(?P<F{i}>{_fmt_to_regex(fmt, f'F{i}_')})" for i, fmt in enumerate(TIMESTAMP_FORMATS)),
+    re.IGNORECASE,
+)
+_FORMAT_INDEX = {f"F{i}": i for i in range(len(TIMESTAMP_FORMATS))}
+_FORMAT_FIELDS = [tuple(f"F{i}_{field}" for field in DATETIME_FIELDS) for i in range(len(TIMESTAMP_FORMATS))]
+
+def _fmt_shape(fmt):
+    return re.sub(r"%[mdHMS]", "N", fmt)
+
+# A format may be tried out of order only if no earlier format has the same
+# shape (e.g. %m-%d-%Y must not jump ahead of %d-%m-%Y for "01-10-2025")
+CACHEABLE_FORMATS = [
+    all(_fmt_shape(fmt) != _fmt_shape(earlier) for earlier in TIMESTAMP_FORMATS[:i])
+    for i, fmt in enumerate(TIMESTAMP_FORMATS)
+]
+
+# Devices emit one format per batch, so the last hit is tried before the full scan.
+# Racing threads can only change which format is tried first, not the result.
+_LAST_FMT_IDX = 0
+
+def _match_format(ts, index):
+    m = COMPILED_FORMATS[index][1].fullmatch(ts)
+    if m is None:
+        return None
+    try:
+        return datetime(*map(int, m.group(*DATETIME_FIELDS)))
+    except ValueError:
+        return None
+
+def _parse_formats(ts):
+    """Return (datetime, format index) for the first format that parses ts, else (None, None)."""
+    global _LAST_FMT_IDX
+    # Every format is at least 9 characters ("%Y%m%d%H%M%S" with 1-digit fields) and ends in %S
+    if len(ts) < 9 or not ts[-1].isdigit():
+        return None, None
+    last = _LAST_FMT_IDX
+    if last:  # format 0 is the alternation's first branch anyway
+        parsed = _match_format(ts, last)
+        if parsed is not None:
+            return parsed, last
+
+    m = TIMESTAMP_RE.fullmatch(ts)
+    if m is None:
+        return None, None
+    index = _FORMAT_INDEX[m.lastgroup]
+    try:
+        parsed = datetime(*map(int, m.group(*_FORMAT_FIELDS[index])))
+        if CACHEABLE_FORMATS[index]:
+            _LAST_FMT_IDX = index
+        return parsed, index
+    except ValueError:
+        # Matched but out of range (e.g. 31 April): later formats still get a turn
+        for later in range(index + 1, len(COMPILED_FORMATS)):
+            parsed = _match_format(ts, later)
+            if parsed is not None:
+                return parsed, later
+        return None, None
+
+def safe_parse_timestamp(ts):
+    """Return a naive datetime, or None if ts cannot be parsed."""
+    # Exact-type check first: pyzk hands back plain naive datetimes
+    if ts.__class__ is datetime and ts.tzinfo is None:
+        return ts
+    if isinstance(ts, datetime):
+        # Keep the device wall clock: DEVICE_TIME_SHIFT is applied to local
+        # device time, so converting to UTC here would shift twice
+        return ts.replace(tzinfo=None)
+
+    if isinstance(ts, str):
+        return _parse_str(ts)
+    return None
+
+# Punches arrive in bursts, so the same raw string is often seen many times
+@lru_cache(maxsize=4096)
+def _parse_str(ts):
+    # C-level fast path for "YYYY-MM-DD HH:MM:SS" (or the ISO "T" form)
+    if len(ts) == 19 and ts[10] in " T" and ts[4] == ts[7] == "-" and ts[13] == ts[16] == ":":
+        try:
+            return datetime.fromisoformat(ts)
+        except ValueError:
+            pass
+    # "YYYY/MM/DD HH:MM:SS": no earlier format uses "/", so the ISO parse gives the same result
+    elif len(ts) == 19 and ts[10] == " " and ts[4] == ts[7] == "/" and ts[13] == ts[16] == ":":
+        try:
+            return datetime.fromisoformat(f"{ts[:4]}-{ts[5:7]}-{ts[8:]}")
+        except ValueError:
+            pass
+    # Fixed-width "%Y%m%d%H%M%S"; odd splits the regex allows still fall through to it
+    elif len(ts) == 14 and ts.isdigit() and ts.isascii():
+        try:
+            return datetime(int(ts[:4]), int(ts[4:6]), int(ts[6:8]), int(ts[8:10]), int(ts[10:12]), int(ts[12:]))
+        except ValueError:
+            pass
+    return _parse_formats(ts)[0]
+
+def describe_timestamp(ts):
+    """Diagnostics for a raw timestamp; slow, so only used for failures and debugging."""
+    debug = {
+        "original_value": ts,
+        "original_type": type(ts).__name__,
+        "parsed_successfully": False,
+        "format_used": None,
+        "timezone_info": None,
+    }
+
+    if isinstance(ts, datetime):
+        debug["parsed_successfully"] = True
+        debug["format_used"] = "datetime_object"
+        debug["timezone_info"] = str(ts.tzinfo) if ts.tzinfo else "naive"
+        return debug
+
+    if isinstance(ts, str) and safe_parse_timestamp(ts) is not None:
+        debug["parsed_successfully"] = True
+        index = _parse_formats(ts)[1]
+        debug["format_used"] = TIMESTAMP_FORMATS[index] if index is not None else "iso_8601"
+        debug["timezone_info"] = "naive_from_string"
+        return debug
+
+    debug["error"] = "Unable to parse timestamp"
+    return debug
+
+# =====================================================
+# DEVICE CONFIG
+# =====================================================
+DEFAULT_PORT = int(os.getenv("DEVICE_PORT", 4370))
+DEFAULT_DEVICE_IP = os.getenv("DEVICE_IP")
+MAX_RETRIES = 3
+RETRY_DELAY = 2  # seconds
+DEVICE_GMT_OFFSET = -8  # If device is Etc/GMT+8, shift by 16h to PHT
+DEVICE_TIME_SHIFT = timedelta(hours=8 - DEVICE_GMT_OFFSET)  # 8 - (-8) = 16h
+
+def connect_device(ip: str):
+    zk = ZK(ip, port=DEFAULT_PORT, timeout=5)
+    conn = zk.connect()
+    return zk, conn
+
+# =====================================================
+# DEVICE CONNECTION POOL
+# =====================================================
+DEVICE_POOL_SIZE = int(os.getenv("DEVICE_POOL_SIZE", 1))  # sessions per device
+DEVICE_IDLE_TIMEOUT = int(os.getenv("DEVICE_IDLE_TIMEOUT", 30))  # seconds unused before a session is closed
+
+class _Device:
+    """Pool state for one device IP."""
+    __slots__ = ("idle", "slots", "users")
+
+    def __init__(self, size):
+        self.idle = queue.Queue()  # (conn, last used)
+        self.slots = threading.BoundedSemaphore(size)
+        self.users = 0  # checkouts and keepalive passes currently holding this entry
+
+class ZKPool:
+    """
+    Keeps device sessions open between requests instead of reconnecting each time.
+    At most `size` sessions exist per device; extra requests wait for a free one.
+    Sessions left unused for `idle_timeout` seconds are closed so the device's
+    limited connection slots are not held forever.
+    """
+
+    def __init__(self, size=DEVICE_POOL_SIZE, keepalive=None, idle_timeout=DEVICE_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # Ping well inside the idle window so a session gets several checks before it expires
+        self.keepalive = keepalive or max(idle_timeout / 3, 1)
+        self._devices = {}  # ip -> _Device
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+
+    def _acquire(self, ip):
+        with self._lock:
+            device = self._devices.get(ip)
+            if device is None:
+                device = self._devices[ip] = _Device(self.size)
+            device.users += 1
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+                self._keepalive_thread.start()
+            return device
+
+    def _release(self, ip, device):
+        with self._lock:
+            device.users -= 1
+            # Forget devices with no pooled session and no user, so arbitrary ?ip= values don't pile up
+            if not device.users and device.idle.empty() and self._devices.get(ip) is device:
+                del self._devices[ip]
+
+    @contextmanager
+    def checkout(self, ip):
+        """Yield a live connection; it goes back to the pool unless it failed or was discarded."""
+        device = self._acquire(ip)
+        try:
+            with device.slots:
+                conn = self._take_idle(device.idle)
+                if conn is None:
+                    zk, conn = connect_device(ip)
+                try:
+                    yield conn
+                except Exception:
+                    self.discard(conn)
+                    raise
+                if conn.is_connect:
+                    device.idle.put((conn, time.monotonic()))
+        finally:
+            self._release(ip, device)
+
+    def _take_idle(self, idle):
+        """Pop a pooled connection that has not outlived idle_timeout, closing stale ones."""
+        while True:
+            try:
+                conn, last_used = idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - last_used <= self.idle_timeout:
+                return conn
+            self.discard(conn)
+
+    def discard(self, conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+        conn.is_connect = False
+
+    def close_all(self):
+        with self._lock:
+            devices = list(self._devices.values())
+        for device in devices:
+            while True:
+                try:
+                    self.discard(device.idle.get_nowait()[0])
+                except queue.Empty:
+                    break
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(self.keepalive)
+            with self._lock:
+                devices = list(self._devices.items())
+                for ip, device in devices:
+                    device.users += 1
+            for ip, device in devices:
+                try:
+                    self._keepalive_device(device)
+                finally:
+                    self._release(ip, device)
+
+    def _keepalive_device(self, device):
+        # Only ping sessions nobody is using right now
+        if not device.slots.acquire(blocking=False):
+            return
+        try:
+            conn, last_used = device.idle.get_nowait()
+        except queue.Empty:
+            device.slots.release()
+            return
+        try:
+            if time.monotonic() - last_used > self.idle_timeout:
+                self.discard(conn)
+                return
+            conn.get_time()
+            # A ping is not a use: last_used is kept so the session still expires
+            device.idle.put((conn, last_used))
+        except Exception:
+            self.discard(conn)
+        finally:
+            device.slots.release()
+
+device_pool = ZKPool()
+atexit.register(device_pool.close_all)
+
+# Strictly zero-padded ASCII "YYYY-MM-DD HH:MM:SS" with in-range fields. Days stop at 28
+# so every match is a real date; 29-31 (and year 0000) go through the parser instead.
+CANONICAL_TIMESTAMP_RE = re.compile(
+    r"(?!0000)[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|1[0-9]|2[0-8]) (?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]"
+)
+
+def is_canonical_timestamp(raw):
+    """True for valid "YYYY-MM-DD HH:MM:SS" strings, whose text order is chronological."""
+    return CANONICAL_TIMESTAMP_RE.fullmatch(raw) is not None
+
+def parse_attendance(attendances, skip_before=None):
+    """
+    Yield (index, att, parsed_ts) so each timestamp is parsed exactly once.
+    With skip_before (in raw device time), older records are dropped here; the
+    filtered and unfiltered cases are separate loops so neither re-checks it per row.
+    """
+    if skip_before is None:
+        return _parse_all(attendances)
+    return _parse_since(attendances, skip_before)
+
+def _parse_all(attendances):
+    dt, parse = datetime, safe_parse_timestamp  # locals for the per-record loop
+    for i, att in enumerate(attendances):
+        raw = att.timestamp
+        # Naive datetimes are pyzk's normal output: nothing to parse
+        if raw.__class__ is dt and raw.tzinfo is None:
+            yield i, att, raw
+        else:
+            yield i, att, parse(raw)
+
+_get_timestamp = attrgetter("timestamp")
+
+def _sorted_skip(attendances, skip_before):
+    """
+    Count of leading records older than skip_before, found by bisection when the
+    raw timestamps are naive datetimes in chronological order (pyzk's usual
+    output); None when that cannot be established cheaply.
+    """
+    if not isinstance(attendances, list) or not attendances:
+        return None
+    raws = list(map(_get_timestamp, attendances))
+    first = raws[0]
+    if type(first) is not datetime or first.tzinfo is not None:
+        return None
+    try:
+        # Ordering a naive datetime against anything else (str, None, aware) raises TypeError
+        if not all(map(le, raws, islice(raws, 1, None))):
+            return None
+    except TypeError:
+        return None
+    return bisect_left(raws, skip_before)
+
+def _parse_since(attendances, skip_before):
+    skip = _sorted_skip(attendances, skip_before)
+    if skip is not None:
+        # Everything past the cut is a naive datetime >= skip_before
+        for i in range(skip, len(attendances)):
+            att = attendances[i]
+            yield i, att, att.timestamp
+        return
+
+    skip_text = skip_before.isoformat(sep=" ")
+    for i, att in enumerate(attendances):
+        raw = att.timestamp
+        if type(raw) is datetime and raw.tzinfo is None:
+            if raw >= skip_before:
+                yield i, att, raw
+            continue
+        # Canonical strings always parse and compare as text, so older ones are never parsed
+        if isinstance(raw, str) and raw < skip_text and is_canonical_timestamp(raw):
+            continue
+        ts = safe_parse_timestamp(raw)
+        # Unparseable records are always kept so /logs can report them
+        if ts is None or ts >= skip_before:
+            yield i, att, ts
+
+def safe_get_attendance(conn, device_ip, skip_before=None):
+    records, error_info = fetch_attendance(conn, device_ip)
+    if records is None:
+        return None, error_info
+    return parse_attendance(records, skip_before), None
+
+def fetch_attendance(conn, device_ip):
+    """Raw attendance records from the device, or (None, error dict)."""
+    try:
+        return conn.get_attendance(), None
+    except Exception as e:
+        error_msg = str(e)
+        if "day is out of range for month" in error_msg:
+            return None, {
+                "error_type": "timezone_date_parsing_error",
+                "original_error": error_msg,
+                "device_ip": device_ip,
+                "timezone_used": "Asia/Manila",
+            }
+        return None, {
+            "error_type": "general_error",
+            "original_error": error_msg,
+            "device_ip": device_ip,
+        }
+
+def sync_device_time(device_ip):
+    """Sync device clock to current server PHT."""
+    try:
+        with device_pool.checkout(device_ip) as conn:
+            now = datetime.now()
+            conn.set_time(now)
+        return True, now
+    except Exception as e:
+        return False, str(e)
+
+# =====================================================
+# PUNCH STATE MAP
+# =====================================================
+PUNCH_STATE = {
+    0: "IN",
+    1: "OUT",
+    2: "BREAK_IN",
+    3: "BREAK_OUT",
+    4: "OVERTIME_IN",
+    5: "OVERTIME_OUT",
+}
+# Codes are 0..5, so hot loops index a tuple instead of hashing into the dict
+PUNCH_LABELS = tuple(PUNCH_STATE[code] for code in range(len(PUNCH_STATE)))
+
+# =====================================================
+# TIME CHECK FUNCTION
+# =====================================================
+def check_all_times(device_ip):
+    container_time = datetime.now()
+    server_time = datetime.utcnow() + timedelta(hours=8)  # PHT
+    try:
+        with device_pool.checkout(device_ip) as conn:
+            device_time = conn.get_time()
+    except Exception as e:
+        device_time = f"Error: {str(e)}"
+
+    diff_server_device = diff_container_device = None
+    if isinstance(device_time, datetime):
+        diff_server_device = server_time - device_time
+        diff_container_device = container_time - device_time
+
+    return {
+        "container_time": str(container_time),
+        "server_time": str(server_time),
+        "device_time": str(device_time),
+        "diff_server_device": str(diff_server_device),
+        "diff_container_device": str(diff_container_device),
+    }
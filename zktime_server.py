@@ -1,191 +1,133 @@
-from flask import Flask, jsonify, request
-from zk import ZK, const
-from datetime import datetime, timedelta
-import os, time, locale
-
-# =====================================================
-# ENVIRONMENT INITIALIZATION (Docker / K8s SAFE)
-# =====================================================
-def initialize_environment():
-    """Force consistent locale and timezone handling (PHT)."""
-    try:
-        locale.setlocale(locale.LC_ALL, "C")
-    except:
-        pass
-    os.environ["TZ"] = "Asia/Manila"  # UTC+8
-    if hasattr(time, "tzset"):
-        time.tzset()
-
-initialize_environment()
+from flask import Flask, request
+from datetime import datetime
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter
+import os, sys, time, locale, platform, threading
+import orjson
+
+from zktime_core import (
+    DEFAULT_DEVICE_IP, MAX_RETRIES, RETRY_DELAY, DEVICE_TIME_SHIFT, PUNCH_LABELS,
+    device_pool, safe_get_attendance, fetch_attendance, parse_attendance,
+    describe_timestamp, sync_device_time, check_all_times,
+)
 
 app = Flask(__name__)
 
-# =====================================================
-# TIMESTAMP FORMATS
-# =====================================================
-TIMESTAMP_FORMATS = [
-    "%Y-%m-%d %H:%M:%S",
-    "%d-%m-%Y %H:%M:%S",
-    "%m-%d-%Y %H:%M:%S",
-    "%Y/%m/%d %H:%M:%S",
-    "%d/%m/%Y %H:%M:%S",
-    "%m/%d/%Y %H:%M:%S",
-    "%Y%m%d%H%M%S",
-    "%d.%m.%Y %H:%M:%S",
-    "%Y.%m.%d %H:%M:%S",
-]
-
-def safe_parse_timestamp(ts):
-    debug = {
-        "original_value": ts,
-        "original_type": type(ts).__name__,
-        "parsed_successfully": False,
-        "format_used": None,
-    }
-
-    if isinstance(ts, datetime):
-        debug["parsed_successfully"] = True
-        debug["format_used"] = "datetime_object"
-        return ts.replace(tzinfo=None), debug
-
-    if isinstance(ts, str):
-        for fmt in TIMESTAMP_FORMATS:
-            try:
-                parsed = datetime.strptime(ts, fmt)
-                debug["parsed_successfully"] = True
-                debug["format_used"] = fmt
-                return parsed, debug
-            except ValueError:
-                continue
-
-    debug["error"] = "Unable to parse timestamp"
-    return None, debug
+def ojson(payload, status=200):
+    """JSON response serialized with orjson instead of Flask's stdlib encoder."""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
 
 # =====================================================
-# DEVICE CONFIG
+# /logs RESPONSE CACHE
 # =====================================================
-DEFAULT_PORT = int(os.getenv("DEVICE_PORT", 4370))
-DEFAULT_DEVICE_IP = os.getenv("DEVICE_IP")
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
-DEVICE_GMT_OFFSET = -8  # If device is Etc/GMT+8, shift by 16h to PHT
-
-def connect_device(ip: str):
-    zk = ZK(ip, port=DEFAULT_PORT, timeout=5)
-    conn = zk.connect()
-    return zk, conn
-
-def safe_get_attendance(conn, device_ip):
-    try:
-        return conn.get_attendance(), None
-    except Exception as e:
-        error_msg = str(e)
-        if "day is out of range for month" in error_msg:
-            return None, {
-                "error_type": "timezone_date_parsing_error",
-                "original_error": error_msg,
-                "device_ip": device_ip,
-                "timezone_used": "Asia/Manila",
-            }
-        return None, {
-            "error_type": "general_error",
-            "original_error": error_msg,
-            "device_ip": device_ip,
-        }
-
-def sync_device_time(device_ip):
-    """Sync device clock to current server PHT."""
-    zk = ZK(device_ip, port=DEFAULT_PORT, timeout=5)
-    try:
-        conn = zk.connect()
-        now = datetime.now()
-        conn.set_time(now)
-        conn.disconnect()
-        return True, now
-    except Exception as e:
-        return False, str(e)
+LOGS_CACHE_TTL = int(os.getenv("LOGS_CACHE_TTL", 5))  # seconds
+LOGS_CACHE_MAXSIZE = 64
+
+_logs_cache = OrderedDict()  # (ip, start, columnar) -> (expires_at, body bytes)
+_logs_cache_lock = threading.Lock()
+
+def logs_cache_get(key):
+    with _logs_cache_lock:
+        entry = _logs_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _logs_cache[key]
+            return None
+        _logs_cache.move_to_end(key)
+        return entry[1]
+
+def logs_cache_put(key, body):
+    with _logs_cache_lock:
+        _logs_cache[key] = (time.monotonic() + LOGS_CACHE_TTL, body)
+        _logs_cache.move_to_end(key)
+        while len(_logs_cache) > LOGS_CACHE_MAXSIZE:
+            _logs_cache.popitem(last=False)
+
+def logs_cache_invalidate(ip):
+    with _logs_cache_lock:
+        keys = [key for key in _logs_cache if key[0] == ip]
+        for key in keys:
+            del _logs_cache[key]
+        return len(keys)
+
+def cache_stream(key, chunks):
+    """Pass chunks through and cache the full body once the stream completes."""
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    logs_cache_put(key, b"".join(body))
 
 # =====================================================
-# PUNCH STATE MAP
-# =====================================================
-PUNCH_STATE = {
-    0: "IN",
-    1: "OUT",
-    2: "BREAK_IN",
-    3: "BREAK_OUT",
-    4: "OVERTIME_IN",
-    5: "OVERTIME_OUT",
-}
-
-# =====================================================
-# TIME CHECK FUNCTION
+# /logs ROUTE
 # =====================================================
-def check_all_times(device_ip):
-    container_time = datetime.now()
-    server_time = datetime.utcnow() + timedelta(hours=8)  # PHT
+@lru_cache(maxsize=64)
+def parse_start(start_date_str):
+    """?start=YYYY-MM-DD as raw device time; raises ValueError. Cached since pollers resend the same value."""
+    start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
     try:
-        zk, conn = connect_device(device_ip)
-        device_time = conn.get_time()
-        conn.disconnect()
-    except Exception as e:
-        device_time = f"Error: {str(e)}"
-
-    diff_server_device = diff_container_device = None
-    if isinstance(device_time, datetime):
-        diff_server_device = server_time - device_time
-        diff_container_device = container_time - device_time
-
-    return {
-        "container_time": str(container_time),
-        "server_time": str(server_time),
-        "device_time": str(device_time),
-        "diff_server_device": str(diff_server_device),
-        "diff_container_device": str(diff_container_device),
-    }
+        return start_date - DEVICE_TIME_SHIFT
+    except OverflowError:
+        # Cutoff falls before year 1: datetime.min keeps every record
+        return datetime.min
 
-# =====================================================
-# /logs ROUTE
-# =====================================================
 @app.route("/logs")
 def get_logs():
     ip = request.args.get("ip") or DEFAULT_DEVICE_IP
     if not ip:
-        return jsonify({"success": False, "message": "Missing ip"}), 400
+        return ojson({"success": False, "message": "Missing ip"}, 400)
 
     start_date_str = request.args.get("start")
+    # Reject a bad start before touching the cache or the device.
+    # raw_start is in device time; parse_attendance drops older records before any row work
     try:
-        start_date = datetime.strptime(start_date_str, "%Y-%m-%d") if start_date_str else None
-    except Exception:
-        start_date = None
+        raw_start = parse_start(start_date_str) if start_date_str else None
+    except ValueError:
+        return ojson({"success": False, "message": "Invalid start date, expected YYYY-MM-DD", "start": start_date_str}, 400)
+
+    columnar = request.args.get("layout") == "columns"
+    cache_key = (ip, start_date_str or "", columnar)
+    use_cache = request.args.get("nocache") != "1"
+    cache_headers = {"Cache-Control": f"max-age={LOGS_CACHE_TTL}"}
+    if use_cache:
+        cached = logs_cache_get(cache_key)
+        if cached is not None:
+            return app.response_class(cached, mimetype="application/json", headers=cache_headers)
 
     # Retry logic for device connection
     attendances = None
     error_info = None
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            zk, conn = connect_device(ip)
-            attendances, error_info = safe_get_attendance(conn, ip)
-            conn.disconnect()
+            with device_pool.checkout(ip) as conn:
+                attendances, error_info = safe_get_attendance(conn, ip, raw_start)
+                if attendances is None:
+                    device_pool.discard(conn)
             if attendances is not None:
                 break
         except Exception as e:
             error_info = {"error_type": "connection_error", "original_error": str(e), "device_ip": ip}
-        time.sleep(RETRY_DELAY)
+        # Back off only between attempts, never after the last one
+        if attempt < MAX_RETRIES:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
 
     logs = []
-    parsing_errors = []
 
     if attendances is None and error_info:
         # Include device error as pseudo-log
-        logs.append({
+        error_log = {
             "user_id": None,
             "timestamp": str(datetime.now()),
             "punch": "ERROR",
             "raw_punch_code": None,
             "corrupted": True,
             "device_error": error_info
-        })
-        return jsonify({
+        }
+        logs = {key: [value] for key, value in error_log.items()} if columnar else [error_log]
+        return ojson({
             "success": True,
             "device_ip": ip,
             "count": 0,
@@ -193,50 +135,130 @@ def get_logs():
             "total_parsing_errors": 0,
         })
 
-    # Process each attendance record
-    for i, att in enumerate(attendances):
-        ts, debug = safe_parse_timestamp(att.timestamp)
+    parsing_errors = {"total": 0, "sample": []}
+    rows = build_log_rows(attendances, parsing_errors)
+    if columnar:
+        body = orjson.dumps(log_columns(ip, rows, parsing_errors))
+        if use_cache:
+            logs_cache_put(cache_key, body)
+            return app.response_class(body, mimetype="application/json", headers=cache_headers)
+        return app.response_class(body, mimetype="application/json")
+
+    # Rows are serialized as they are built instead of collected first
+    body = stream_logs(ip, rows, parsing_errors)
+    if not use_cache:
+        return app.response_class(body, mimetype="application/json")
+    return app.response_class(cache_stream(cache_key, body), mimetype="application/json", headers=cache_headers)
+
+LOG_FIELDS = ("user_id", "timestamp", "punch", "raw_punch_code", "corrupted")
 
+ATTENDANCE_ATTRS = ("user_id", "timestamp", "punch", "status")
+_ATT_GET = attrgetter(*ATTENDANCE_ATTRS)
+
+def attendance_fields(att):
+    """(user_id, timestamp, punch, status) of a record; missing attributes read as None."""
+    try:
+        return _ATT_GET(att)
+    except AttributeError:
+        return tuple(getattr(att, name, None) for name in ATTENDANCE_ATTRS)
+
+REPORTED_PARSING_ERRORS = 10  # described per response; further failures are only counted
+
+def build_log_rows(attendances, parsing_errors):
+    """
+    Yield /logs rows as LOG_FIELDS tuples. Unparseable records are counted in
+    parsing_errors["total"] and the first few described in parsing_errors["sample"].
+    """
+    sample = parsing_errors["sample"]
+    labels = PUNCH_LABELS  # local names: LOAD_FAST in the loop below
+    label_count = len(labels)
+    shift = DEVICE_TIME_SHIFT
+    for i, att, ts in attendances:
+        shift_error = None
         if ts:
             # Adjust if device is Etc/GMT+8 (UTC-8) → shift 16h to PHT
-            ts += timedelta(hours=8 - DEVICE_GMT_OFFSET)  # 8 - (-8) = 16h
-        else:
-            parsing_errors.append({
-                "index": i,
-                "user_id": getattr(att, "user_id", None),
-                "original_value": debug["original_value"],
-                "original_type": debug["original_type"],
-                "error": debug.get("error", "Unknown parse error"),
-            })
-            logs.append({
-                "user_id": getattr(att, "user_id", None),
-                "timestamp": str(debug["original_value"]),
-                "punch": PUNCH_STATE.get(getattr(att, "punch", getattr(att, "status", None)), "Unknown"),
-                "raw_punch_code": getattr(att, "punch", getattr(att, "status", None)),
-                "corrupted": True
-            })
-            continue
+            try:
+                ts += shift
+            except OverflowError:
+                # Past datetime.max: report the record as corrupted instead of aborting the stream
+                ts, shift_error = None, "Timestamp out of range after device time shift"
 
-        if start_date and ts < start_date:
+        # One __dict__ fetch serves every field; pyzk's Attendance is a plain class
+        try:
+            fields = att.__dict__
+        except AttributeError:  # __slots__ records
+            fields = dict(zip(ATTENDANCE_ATTRS, attendance_fields(att)))
+        punch_code = fields.get("punch")
+        if punch_code is None:
+            punch_code = fields.get("status")
+        punch_label = labels[punch_code] if isinstance(punch_code, int) and 0 <= punch_code < label_count else "Unknown"
+
+        if not ts:
+            user_id, raw_ts, _, _ = attendance_fields(att)
+            parsing_errors["total"] += 1
+            # Diagnostics are slow, so only build them for errors that get reported
+            if len(sample) < REPORTED_PARSING_ERRORS:
+                debug = describe_timestamp(raw_ts)
+                sample.append({
+                    "index": i,
+                    "user_id": user_id,
+                    "original_value": debug["original_value"],
+                    "original_type": debug["original_type"],
+                    "error": shift_error or debug.get("error", "Unknown parse error"),
+                })
+            yield user_id, str(raw_ts), punch_label, punch_code, True
             continue
 
-        punch_code = getattr(att, "punch", getattr(att, "status", None))
-        logs.append({
-            "user_id": att.user_id,
-            "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
-            "punch": PUNCH_STATE.get(punch_code, "Unknown"),
-            "raw_punch_code": punch_code,
-            "corrupted": False
-        })
-
-    return jsonify({
+        yield fields.get("user_id"), ts.isoformat(" ", "seconds"), punch_label, punch_code, False
+
+STREAM_BATCH_SIZE = 500  # rows per chunk written to the socket
+
+def stream_logs(ip, rows, parsing_errors):
+    """Stream the /logs JSON body; totals go last since they are only known after the rows."""
+    yield b'{"success":true,"device_ip":' + orjson.dumps(ip) + b',"logs":['
+    count = 0
+    batch = []
+    add, dumps, batch_size = batch.append, orjson.dumps, STREAM_BATCH_SIZE  # bound once for the row loop
+    for user_id, timestamp, punch, raw_punch_code, corrupted in rows:
+        add(dumps({
+            "user_id": user_id,
+            "timestamp": timestamp,
+            "punch": punch,
+            "raw_punch_code": raw_punch_code,
+            "corrupted": corrupted
+        }))
+        if len(batch) == batch_size:
+            yield (b"," if count else b"") + b",".join(batch)
+            count += batch_size
+            batch.clear()  # keeps `add` bound to the same list
+    if batch:
+        yield (b"," if count else b"") + b",".join(batch)
+        count += len(batch)
+    yield (b'],"count":' + orjson.dumps(count)
+           + b',"total_parsing_errors":' + orjson.dumps(parsing_errors["total"])
+           + b',"parsing_errors":' + orjson.dumps(parsing_errors["sample"])
+           + b"}")
+
+def log_columns(ip, rows, parsing_errors):
+    """/logs payload with one list per field instead of one object per row (?layout=columns)."""
+    rows = list(rows)
+    columns = dict(zip(LOG_FIELDS, zip(*rows))) if rows else {field: [] for field in LOG_FIELDS}
+    return {
         "success": True,
         "device_ip": ip,
-        "count": len(logs),
-        "logs": logs,
-        "total_parsing_errors": len(parsing_errors),
-        "parsing_errors": parsing_errors[:10]  # first 10
-    })
+        "count": len(rows),
+        "logs": columns,
+        "total_parsing_errors": parsing_errors["total"],
+        "parsing_errors": parsing_errors["sample"],
+    }
+
+@app.route("/logs/invalidate")
+def invalidate_logs():
+    ip = request.args.get("ip") or DEFAULT_DEVICE_IP
+    if not ip:
+        return ojson({"success": False, "message": "Missing ip"}, 400)
+
+    return ojson({"success": True, "device_ip": ip, "invalidated": logs_cache_invalidate(ip)})
 
 # =====================================================
 # OTHER ROUTES
@@ -245,44 +267,123 @@ def get_logs():
 def ping_test():
     ip = request.args.get("ip") or DEFAULT_DEVICE_IP
     if not ip:
-        return jsonify({"success": False, "message": "Missing ip"}), 400
+        return ojson({"success": False, "message": "Missing ip"}, 400)
     try:
-        zk, conn = connect_device(ip)
-        info = conn.get_device_name()
-        conn.disconnect()
-        return jsonify({"success": True, "device_info": info})
+        with device_pool.checkout(ip) as conn:
+            info = conn.get_device_name()
+        return ojson({"success": True, "device_info": info})
     except Exception as e:
-        return jsonify({"success": False, "message": str(e)}), 500
+        return ojson({"success": False, "message": str(e)}, 500)
 
 @app.route("/sync-time")
 def sync_time():
     ip = request.args.get("ip") or DEFAULT_DEVICE_IP
     if not ip:
-        return jsonify({"success": False, "message": "Missing ip"}), 400
+        return ojson({"success": False, "message": "Missing ip"}, 400)
 
     success, result = sync_device_time(ip)
     if success:
-        return jsonify({"success": True, "device_ip": ip, "synced_time": str(result)})
+        return ojson({"success": True, "device_ip": ip, "synced_time": str(result)})
     else:
-        return jsonify({"success": False, "device_ip": ip, "error": result})
+        return ojson({"success": False, "device_ip": ip, "error": result})
 
 @app.route("/time-check")
 def time_check():
     ip = request.args.get("ip") or DEFAULT_DEVICE_IP
     if not ip:
-        return jsonify({"success": False, "message": "Missing ip"}), 400
+        return ojson({"success": False, "message": "Missing ip"}, 400)
 
     times_info = check_all_times(ip)
-    return jsonify({"success": True, "device_ip": ip, "times": times_info})
+    return ojson({"success": True, "device_ip": ip, "times": times_info})
+
+@app.route("/debug-timestamps")
+def debug_timestamps():
+    """Show raw device timestamps next to how they parse."""
+    ip = request.args.get("ip") or DEFAULT_DEVICE_IP
+    if not ip:
+        return ojson({"success": False, "message": "Missing ip"}, 400)
+    limit = max(int(request.args.get("limit", 5)), 0)  # first N records
+
+    try:
+        with device_pool.checkout(ip) as conn:
+            records, error_info = fetch_attendance(conn, ip)
+            if records is None:
+                device_pool.discard(conn)
+    except Exception as e:
+        return ojson({"success": False, "message": str(e), "device_ip": ip}, 500)
+    if records is None:
+        return ojson({"success": False, "device_ip": ip, "library_error": error_info}, 500)
+
+    # Only the sampled records are parsed; the rest are just counted
+    debug_data = []
+    for i, att, ts in islice(parse_attendance(records), limit):
+        user_id, raw_ts, punch_code, status = attendance_fields(att)
+        debug_data.append({
+            "user_id": user_id,
+            "raw_timestamp": str(raw_ts),
+            "raw_timestamp_type": type(raw_ts).__name__,
+            "raw_timestamp_repr": repr(raw_ts),
+            "parsed_timestamp": ts.isoformat(" ", "seconds") if ts else None,
+            "debug_info": describe_timestamp(raw_ts),
+            "punch_code": punch_code,
+            "status": status,
+        })
+
+    return ojson({"success": True, "device_ip": ip, "total_records": len(records), "debug_sample": debug_data})
+
+@app.route("/debug-environment")
+def debug_environment():
+    """Show Python, locale and timezone details of the running container."""
+    try:
+        import zk
+        zk_version = getattr(zk, "__version__", "unknown")
+    except Exception:
+        zk_version = "unknown"
+
+    try:
+        current_locale = locale.getlocale()
+        default_locale = locale.getdefaultlocale()
+    except Exception:
+        current_locale = default_locale = "unknown"
+
+    try:
+        timezone_info = {
+            "timezone_name": time.tzname,
+            "daylight_saving": time.daylight,
+            "timezone_offset": time.timezone,
+            "current_time": datetime.now().isoformat(" ", "seconds"),
+            "utc_time": datetime.utcnow().isoformat(" ", "seconds"),
+        }
+    except Exception:
+        timezone_info = "unknown"
+
+    return ojson({
+        "python_version": sys.version,
+        "platform": platform.platform(),
+        "pyzk_version": zk_version,
+        "current_locale": current_locale,
+        "default_locale": default_locale,
+        "timezone_info": timezone_info,
+        "environment_vars": {
+            "TZ": os.environ.get("TZ", "not_set"),
+            "LANG": os.environ.get("LANG", "not_set"),
+            "LC_ALL": os.environ.get("LC_ALL", "not_set"),
+            "LC_TIME": os.environ.get("LC_TIME", "not_set"),
+        },
+    })
 
 @app.route("/")
 def home():
-    return jsonify({
+    return ojson({
         "routes": {
             "/ping-test?ip=DEVICE_IP": "Test device connection",
             "/logs?ip=DEVICE_IP&start=YYYY-MM-DD": "Fetch attendance logs (corrupted logs included)",
+            "/logs?ip=DEVICE_IP&layout=columns": "Same logs as one list per field",
+            "/logs/invalidate?ip=DEVICE_IP": "Drop cached /logs responses for a device",
             "/sync-time?ip=DEVICE_IP": "Sync device clock to server PHT",
             "/time-check?ip=DEVICE_IP": "Check container/server/device time",
+            "/debug-timestamps?ip=DEVICE_IP&limit=5": "Debug timestamp formats (default 5 records)",
+            "/debug-environment": "Show environment info (Python version, locale, etc.)",
         },
         "timezone": "Asia/Manila (PHT)",
     })
@@ -290,5 +391,6 @@ def home():
 # =====================================================
 # RUN FLASK
 # =====================================================
+# Local development only; the container serves the app through gunicorn
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=4000, debug=True)
+    app.run(host="0.0.0.0", port=4000, debug=os.getenv("FLASK_DEBUG") == "1", threaded=True)